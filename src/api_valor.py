@@ -1,30 +1,125 @@
 # src/api_valor.py
+from contextlib import asynccontextmanager
+
+from typing import Annotated, Literal, Union
+
+import anyio.to_thread
+import orjson
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-import os, json
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, Field, field_validator
+import functools
+import hashlib
+import math
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 
 import rasterio
-from rasterio.warp import transform as rio_transform
-from rasterio.features import rasterize, geometry_mask
+from rasterio import Affine
+from rasterio.enums import Resampling
+from rasterio.errors import WindowError
+from rasterio.features import rasterize
+from rasterio.transform import rowcol
 from rasterio.windows import Window, from_bounds, transform as win_transform
 
-from shapely.geometry import shape, mapping, box
-from shapely.ops import transform as shp_transform
-from shapely.validation import explain_validity
+import shapely
+from shapely import is_valid_reason, make_valid
+from shapely.geometry import Polygon, MultiPolygon, box
+from shapely.ops import unary_union
 from pyproj import Transformer
 from pyproj.exceptions import ProjError
 
 
 # -------- config --------
 caminho_geotiff = os.getenv("PATH_GEOTIFF", "./data/raster_html.tif")
-# Estratégia do /zonal:
-#   "full"   -> lê o raster inteiro e mascara (seu código antigo)
-#   "window" -> lê só a janela (bbox do polígono) e rasteriza máscara (muito mais leve)
-ZONAL_STRATEGY = os.getenv("ZONAL_STRATEGY", "full").lower()  # "full" | "window"
+# block cache do GDAL em MB; ajustável por env para planos com pouca RAM
+GDAL_CACHEMAX_MB = int(os.getenv("GDAL_CACHEMAX_MB", "1024"))
+
+# Abre o raster UMA vez por worker (reabrir a cada request recria o Env do
+# GDAL e re-parseia os metadados do TIFF — custo fixo em todo endpoint).
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # GDAL_CACHEMAX acima do tamanho dos buffers de rasterize: abaixo disso o
+    # GDAL cai num algoritmo tile-a-tile bem mais lento (e o block cache segura
+    # janelas repetidas do /zonal e /point)
+    app.state.env = rasterio.Env(
+        GDAL_CACHEMAX=GDAL_CACHEMAX_MB,
+        GDAL_DISABLE_READDIR_ON_OPEN="EMPTY_DIR",
+        GDAL_NUM_THREADS="ALL_CPUS",  # decodifica blocos DEFLATE do COG em paralelo
+    )
+    app.state.env.__enter__()
+    try:
+        # raster pequeno (<500 MB) vai inteiro para a RAM via MemoryFile:
+        # leituras de janela viram memcpy, sem syscalls de disco por request
+        if os.path.getsize(caminho_geotiff) < 500_000_000:
+            with open(caminho_geotiff, "rb") as f:
+                app.state.memfile = rasterio.MemoryFile(f.read())
+            app.state.src = app.state.memfile.open()
+        else:
+            app.state.memfile = None
+            app.state.src = rasterio.open(caminho_geotiff, sharing=False)
+        # banda decodificada inteira em RAM (float32 aqui ≈ 17 MB): janelas em
+        # resolução plena viram slice numpy, sem nem passar pelo GDAL
+        h, w = app.state.src.height, app.state.src.width
+        if h * w * np.dtype(app.state.src.dtypes[0]).itemsize < 200_000_000:
+            app.state.band = app.state.src.read(1)
+            # máscara de validade (nodata/NaN) computada UMA vez; por request
+            # vira um slice em vez de um not_equal/isnan sobre a janela
+            nodata = app.state.src.nodata
+            valid = np.ones(app.state.band.shape, dtype=bool) if nodata is None \
+                else np.not_equal(app.state.band, nodata)
+            if app.state.band.dtype.kind == "f":
+                valid &= ~np.isnan(app.state.band)
+            app.state.valid = valid
+        else:
+            app.state.band = None  # raster grande: segue lendo por janela
+            app.state.valid = None
+        # Transformer WGS84 -> CRS do raster construído UMA vez (a criação
+        # consulta o banco do PROJ e custa mais que reprojetar um polígono pequeno).
+        # Se o raster já está em WGS84 nem construímos o Transformer.
+        crs = app.state.src.crs
+        if crs is not None and crs.to_epsg() != 4326:
+            app.state.transformer_fn = Transformer.from_crs("EPSG:4326", crs, always_xy=True).transform
+        else:
+            app.state.transformer_fn = None  # raster já em WGS84, nada a reprojetar
+        # afim inverso pré-calculado: src.index refaz a inversão a cada chamada,
+        # e no /point isso é fração relevante do custo total
+        app.state.inv_transform = ~app.state.src.transform
+    except Exception:
+        app.state.src = None  # /healthz reporta "degraded"
+        app.state.memfile = None
+        app.state.band = None
+        app.state.valid = None
+        app.state.transformer_fn = None
+        app.state.inv_transform = None
+    # endpoints são `def` síncronos -> FastAPI roda no threadpool do anyio;
+    # o limite default (40) é baixo para /zonal concorrente em vários núcleos
+    anyio.to_thread.current_default_thread_limiter().total_tokens = 64
+    _point_cached.cache_clear()
+    _zonal_cache.clear()
+    _geom_cache.clear()
+    yield
+    _point_cached.cache_clear()
+    _zonal_cache.clear()
+    _geom_cache.clear()
+    # handles por-thread antes do memfile: eles apontam para o mesmo /vsimem
+    with _tls_srcs_lock:
+        for t in _tls_srcs:
+            if not t.closed:
+                t.close()
+        _tls_srcs.clear()
+    if app.state.src is not None:
+        app.state.src.close()
+    if app.state.memfile is not None:
+        app.state.memfile.close()
+    app.state.env.__exit__(None, None, None)
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -39,67 +134,129 @@ class PointQuery(BaseModel):
     lon: float
     lat: float
 
+class PointBatchQuery(BaseModel):
+    lons: list[float]
+    lats: list[float]
+
+class PolygonGeom(BaseModel):
+    type: Literal["Polygon"]
+    coordinates: list[list[list[float]]]
+
+class MultiPolygonGeom(BaseModel):
+    type: Literal["MultiPolygon"]
+    coordinates: list[list[list[list[float]]]]
+
 class PolygonQuery(BaseModel):
-    geometry: object  # dict (GeoJSON) ou string JSON
+    # união discriminada: o pydantic-core (Rust) valida type/coordinates e o
+    # schema aparece certinho no /docs — nada de isinstance no handler
+    geometry: Annotated[Union[PolygonGeom, MultiPolygonGeom], Field(discriminator="type")]
+    exact: bool = False  # força /zonal em resolução plena (sem overview)
+
+    @field_validator("geometry", mode="before")
+    @classmethod
+    def _parse_geometry(cls, v):
+        # aceita string JSON (como o front antigo mandava) e type fora de caixa
+        if isinstance(v, str):
+            try:
+                v = orjson.loads(v)  # parser Rust/SIMD: geometria grande agradece
+            except Exception:
+                raise ValueError("geometry string inválida")
+        if isinstance(v, dict) and isinstance(v.get("type"), str):
+            t = v["type"].upper()
+            if t == "POLYGON":
+                v = {**v, "type": "Polygon"}
+            elif t == "MULTIPOLYGON":
+                v = {**v, "type": "MultiPolygon"}
+        return v
 
 
 # -------- helpers --------
+def _get_src():
+    """DatasetReader aberto no startup (um por worker)."""
+    src = getattr(app.state, "src", None)
+    if src is None:
+        raise HTTPException(status_code=503, detail=f"raster indisponível: {caminho_geotiff}")
+    return src
+
 def _close_rings(coords):
+    # anéis viram arrays float64 de uma vez; fechar o anel é uma comparação
+    # vetorizada + vstack, sem percorrer vértice a vértice em Python
     def close_ring(r):
-        if not r:
+        r = np.asarray(r, dtype=np.float64)
+        if len(r) == 0:
             return r
-        if r[0][0] != r[-1][0] or r[0][1] != r[-1][1]:
-            return r + [r[0]]
+        if not np.array_equal(r[0], r[-1]):
+            r = np.vstack([r, r[:1]])
         return r
     try:
-        if isinstance(coords[0][0][0], (int, float)):  # Polygon
-            return [close_ring(list(r)) for r in coords]
-        fixed = []
-        for poly in coords:  # MultiPolygon
-            fixed.append([close_ring(list(r)) for r in poly])
-        return fixed
+        if np.ndim(coords[0][0][0]) == 0:  # Polygon: coords[0][0] é um vértice
+            return [close_ring(r) for r in coords]
+        return [[close_ring(r) for r in poly] for poly in coords]  # MultiPolygon
     except Exception:
         return coords
 
 def _to_src_crs(geom_wgs84, src):
-    dst_crs = src.crs
-    if not dst_crs:
-        return geom_wgs84
-    s = str(dst_crs).upper()
-    if s in ("EPSG:4326", "WGS84"):
+    fn = getattr(app.state, "transformer_fn", None)
+    if fn is None:  # raster em WGS84 (ou sem CRS): geometria já está no CRS certo
         return geom_wgs84
     try:
-        transformer = Transformer.from_crs("EPSG:4326", dst_crs, always_xy=True)
-        return shp_transform(lambda x, y, z=None: transformer.transform(x, y), geom_wgs84)
+        # reprojeta todos os vértices numa chamada só do PROJ (arrays), em vez
+        # de uma invocação por coordenada via shapely.ops.transform
+        return shapely.transform(
+            geom_wgs84, lambda xy: np.column_stack(fn(xy[:, 0], xy[:, 1]))
+        )
     except ProjError as e:
         raise HTTPException(status_code=400, detail=f"stage=reproject | {e}")
 
-def _normalize_geom(obj):
-    if isinstance(obj, str):
-        try:
-            obj = json.loads(obj)
-        except Exception:
-            raise HTTPException(status_code=400, detail="stage=normalize | geometry string inválida")
-    if not isinstance(obj, dict):
-        raise HTTPException(status_code=400, detail="stage=normalize | geometry deve ser objeto JSON")
-    gtype = (obj.get("type") or "").upper()
-    if gtype not in {"POLYGON", "MULTIPOLYGON"}:
-        raise HTTPException(status_code=400, detail="stage=normalize | type deve ser Polygon/MultiPolygon")
-    coords = obj.get("coordinates")
+def _normalize_geom(gm):
+    """Recebe PolygonGeom/MultiPolygonGeom já validado pelo pydantic."""
+    coords = gm.coordinates
     if not coords:
         raise HTTPException(status_code=400, detail="stage=normalize | coordinates ausentes")
-    fixed = {"type": "Polygon" if gtype == "POLYGON" else "MultiPolygon",
-             "coordinates": _close_rings(coords)}
+    rings = _close_rings(coords)
     try:
-        geom = shape(fixed)
+        # constrói direto pelos construtores do shapely 2.x (arrays float64 em
+        # bloco via GEOS), sem o round-trip dict -> shape()
+        if gm.type == "Polygon":
+            geom = Polygon(rings[0], rings[1:])
+        else:
+            geom = MultiPolygon([Polygon(p[0], p[1:]) for p in rings])
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"stage=validate | GeoJSON inválido: {e}")
     if geom.is_empty:
         raise HTTPException(status_code=400, detail="stage=validate | geometria vazia")
-    if explain_validity(geom) != "Valid Geometry":
-        geom = geom.buffer(0)
-        if explain_validity(geom) != "Valid Geometry" or geom.is_empty:
-            raise HTTPException(status_code=400, detail="stage=validate | geometria inválida (buffer(0) falhou)")
+    if not geom.is_valid:  # bool direto do GEOS; is_valid_reason só no erro
+        reason = is_valid_reason(geom)
+        # make_valid (GEOS MakeValid) é mais rápido e robusto que buffer(0),
+        # que pode estourar memória em polígonos complexos
+        geom = make_valid(geom)
+        if geom.geom_type == "GeometryCollection":
+            # descarta pontos/linhas degenerados que o MakeValid separa
+            geom = unary_union([g for g in geom.geoms
+                                if g.geom_type in ("Polygon", "MultiPolygon")])
+        if not geom.is_valid or geom.is_empty:
+            raise HTTPException(
+                status_code=400,
+                detail=f"stage=validate | geometria inválida (make_valid falhou): {reason}")
+    return geom
+
+# geometrias shapely são imutáveis, então dá para compartilhar a mesma
+# instância entre requisições; payloads repetidos pulam construção+validação
+_GEOM_CACHE_MAX = 512
+_geom_cache: "OrderedDict[bytes, shapely.Geometry]" = OrderedDict()
+
+def _normalize_geom_cached(gm):
+    """Como _normalize_geom, com LRU keyed no payload bruto (antes do GEOS)."""
+    key = hashlib.blake2b(orjson.dumps([gm.type, gm.coordinates]),
+                          digest_size=16).digest()
+    geom = _geom_cache.get(key)
+    if geom is not None:
+        _geom_cache.move_to_end(key)
+        return geom
+    geom = _normalize_geom(gm)
+    _geom_cache[key] = geom
+    if len(_geom_cache) > _GEOM_CACHE_MAX:
+        _geom_cache.popitem(last=False)
     return geom
 
 
@@ -110,140 +267,329 @@ def root():
 
 @app.get("/healthz")
 def healthz():
-    try:
-        with rasterio.open(caminho_geotiff) as src:
-            return {"status":"ok","tif":caminho_geotiff,"crs":str(src.crs)}
-    except Exception as e:
-        return {"status":"degraded","tif":caminho_geotiff,"detail":str(e)}
+    src = getattr(app.state, "src", None)
+    if src is None:
+        return {"status":"degraded","tif":caminho_geotiff,"detail":"raster não abriu no startup"}
+    return {"status":"ok","tif":caminho_geotiff,"crs":str(src.crs)}
 
 @app.get("/diag")
 def diag():
     """Diagnóstico rápido do raster (útil pra memória/COG)."""
     try:
-        with rasterio.open(caminho_geotiff) as src:
-            h, w = src.height, src.width
-            dtype = src.dtypes[0]
-            bps = np.dtype(dtype).itemsize
-            raw_mb = (h*w*bps)/(1024*1024)
-            return {
-                "path": caminho_geotiff,
-                "size": [h, w],
-                "dtype": dtype,
-                "nodata": src.nodata,
-                "crs": str(src.crs),
-                "tiled": bool(src.profile.get("tiled", False)),
-                "compress": src.profile.get("compress"),
-                "blockxsize": src.profile.get("blockxsize"),
-                "blockysize": src.profile.get("blockysize"),
-                "overviews_b1": src.overviews(1),
-                "raw_uncompressed_estimate_MB": round(raw_mb, 2)
-            }
+        src = _get_src()
+        h, w = src.height, src.width
+        dtype = src.dtypes[0]
+        bps = np.dtype(dtype).itemsize
+        raw_mb = (h*w*bps)/(1024*1024)
+        return {
+            "path": caminho_geotiff,
+            "size": [h, w],
+            "dtype": dtype,
+            "nodata": src.nodata,
+            "crs": str(src.crs),
+            "tiled": bool(src.profile.get("tiled", False)),
+            "compress": src.profile.get("compress"),
+            "blockxsize": src.profile.get("blockxsize"),
+            "blockysize": src.profile.get("blockysize"),
+            "overviews_b1": src.overviews(1),
+            "raw_uncompressed_estimate_MB": round(raw_mb, 2)
+        }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 
 # -------- /point (leve) --------
+def _point_value(src, x, y):
+    """Valor do pixel em coordenadas do CRS do raster (None p/ fora/nodata)."""
+    b = src.bounds
+    if not (b.left <= x <= b.right and b.bottom <= y <= b.top):
+        return None
+    band = getattr(app.state, "band", None)
+    if band is not None:
+        # x,y já estão dentro dos bounds -> frações não-negativas, int() == floor
+        col, row = app.state.inv_transform * (x, y)
+        row, col = int(row), int(col)
+        if row < src.height and col < src.width and app.state.valid[row, col]:
+            return float(band[row, col])
+        return None
+    # sample() lê o pixel direto, sem montar masked array nem Window manual
+    val = next(_thread_src(src).sample([(x, y)], indexes=1))[0]
+    if src.nodata is not None and val == src.nodata:
+        return None
+    return float(val)
+
+@functools.lru_cache(maxsize=4096)
+def _point_cached(lon, lat):
+    """Lê 1 pixel; cacheado porque hover/clique repete muito o mesmo ponto."""
+    src = _get_src()
+    # reprojeta o clique (lon/lat) para o CRS do raster usando o Transformer do startup
+    fn = getattr(app.state, "transformer_fn", None)
+    x, y = fn(lon, lat) if fn is not None else (lon, lat)
+    return _point_value(src, x, y)
+
 @app.post("/point")
 def get_value(q: PointQuery):
     """
     Valor do raster em um ponto (lon/lat WGS84).
-    Lê somente 1 pixel via Window (sem carregar a banda toda).
+    5 casas decimais ≈ 1 m no equador — mais fino que a resolução do raster.
+    """
+    try:
+        return {"value": _point_cached(round(q.lon, 5), round(q.lat, 5))}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"stage=point | {e}")
+
+
+@app.post("/point_batch")
+def get_values(q: PointBatchQuery):
+    """
+    Valores do raster para vários pontos (lon/lat WGS84) numa chamada só.
+    Reprojeção em lote via pyproj e lookup vetorizado na banda em RAM.
     """
     try:
-        with rasterio.open(caminho_geotiff) as src:
-            # reprojeta o clique (lon/lat) para o CRS do raster (já é EPSG:4326 no seu caso)
-            xs, ys = rio_transform("EPSG:4326", src.crs if src.crs else "EPSG:4326", [q.lon], [q.lat])
-            x, y = xs[0], ys[0]
+        if len(q.lons) != len(q.lats):
+            raise HTTPException(status_code=400,
+                                detail="stage=point_batch | lons e lats de tamanhos diferentes")
+        src = _get_src()
+        fn = getattr(app.state, "transformer_fn", None)
+        xs = np.asarray(q.lons, dtype=np.float64)
+        ys = np.asarray(q.lats, dtype=np.float64)
+        if fn is not None:
+            xs, ys = fn(xs, ys)
+        b = src.bounds
+        inb = (xs >= b.left) & (xs <= b.right) & (ys >= b.bottom) & (ys <= b.top)
+        values = [None] * xs.size
+        idx = np.flatnonzero(inb)
+        if idx.size:
+            band = getattr(app.state, "band", None)
+            if band is not None:
+                rows, cols = rowcol(src.transform, xs[idx], ys[idx])
+                rows = np.clip(np.asarray(rows), 0, src.height - 1)
+                cols = np.clip(np.asarray(cols), 0, src.width - 1)
+                vals = band[rows, cols]
+                ok = app.state.valid[rows, cols]
+                for i, v, o in zip(idx, vals, ok):
+                    if o:
+                        values[int(i)] = float(v)
+            else:
+                samples = list(_thread_src(src).sample(zip(xs[idx], ys[idx]), indexes=1))
+                nd = src.nodata
+                for i, s in zip(idx, samples):
+                    v = s[0]
+                    if nd is None or v != nd:
+                        values[int(i)] = float(v)
+        return {"values": values}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"stage=point_batch | {e}")
 
-            # converte para linha/coluna de pixel
-            row, col = src.index(x, y)
-            if row < 0 or col < 0 or row >= src.height or col >= src.width:
-                return {"value": None}
 
-            # LÊ SÓ 1×1 PIXEL (mascarado respeitando NoData)
-            win = Window(col_off=col, row_off=row, width=1, height=1)
-            pix = src.read(1, window=win, masked=True)
+# -------- /zonal --------
+# lado alvo (px) da janela quando podemos usar overview: ~256 px de máscara é
+# mais que suficiente para média de exibição no mapa
+_ZONAL_TARGET_PX = 256
 
-            val = pix[0, 0]
-            if np.ma.is_masked(val):
-                return {"value": None}
+# buffer de máscara reaproveitado por thread: poupa um malloc + zero-fill de
+# h*w bytes em cada rasterize (aparece em profile com QPS alto)
+_scratch = threading.local()
 
-            return {"value": float(val)}
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"stage=point | {e}")
+# leituras GDAL no MESMO DatasetReader não são thread-safe; com a banda em RAM
+# quase nada vira I/O, mas o que sobra (overview, raster grande, sample) usa um
+# handle por thread em vez de serializar tudo num lock
+_tls_srcs: list = []
+_tls_srcs_lock = threading.Lock()
 
+def _thread_src(src):
+    """DatasetReader próprio desta thread sobre o mesmo arquivo (ou /vsimem).
 
-# -------- /zonal (duas estratégias) --------
-def _zonal_full(geom_wgs84):
-    """Estratégia antiga: lê banda inteira e mascara."""
-    with rasterio.open(caminho_geotiff) as src:
-        geom_proj = _to_src_crs(geom_wgs84, src)
-        if not geom_proj.intersects(box(*src.bounds)):
-            return {"mean": None, "count": 0, "note": "fora do raster"}
-        mask = geometry_mask([mapping(geom_proj)],
-                             out_shape=(src.height, src.width),
-                             transform=src.transform,
-                             invert=True)
-        arr = src.read(1)
-        valid = mask
-        if src.nodata is not None:
-            valid &= (arr != src.nodata)
-        vals = arr[valid]
-        if vals.size == 0:
-            return {"mean": None, "count": 0, "note": "sem pixels válidos"}
-        return {"mean": float(np.nanmean(vals.astype(float))), "count": int(vals.size)}
-
-def _zonal_window(geom_wgs84):
-    """Estratégia leve: janela do bbox + rasterize dentro da janela."""
-    with rasterio.open(caminho_geotiff) as src:
-        geom_proj = _to_src_crs(geom_wgs84, src)
-        rb = box(*src.bounds)
-        if not geom_proj.intersects(rb):
-            return {"mean": None, "count": 0, "note": "fora do raster"}
-
-        minx, miny, maxx, maxy = geom_proj.bounds
-        win = from_bounds(minx, miny, maxx, maxy, transform=src.transform)
-        col0 = max(0, int(np.floor(win.col_off)))
-        row0 = max(0, int(np.floor(win.row_off)))
-        col1 = min(src.width,  int(np.ceil(win.col_off + win.width)))
-        row1 = min(src.height, int(np.ceil(win.row_off + win.height)))
-        w = Window(col0, row0, col1-col0, row1-row0)
-        if w.width <= 0 or w.height <= 0:
-            return {"mean": None, "count": 0, "note": "janela vazia"}
-
-        arr = src.read(1, window=w, masked=False)
-        w_transform = win_transform(w, src.transform)
-        mask_poly = rasterize(
-            [(mapping(geom_proj), 1)],
-            out_shape=(int(w.height), int(w.width)),
-            transform=w_transform,
-            fill=0, dtype="uint8"
-        ).astype(bool)
+    Aberto sob demanda e registrado para fechar no shutdown; handle de um
+    lifespan anterior (já fechado ou apontando para outro caminho) é trocado."""
+    t = getattr(_scratch, "src", None)
+    if t is None or t.closed or t.name != src.name:
+        t = rasterio.open(src.name, sharing=False)
+        _scratch.src = t
+        with _tls_srcs_lock:
+            _tls_srcs.append(t)
+    return t
+
+# partes de MultiPolygon rodam em paralelo, cada uma com janela/máscara próprias
+_zonal_pool = ThreadPoolExecutor(max_workers=os.cpu_count() or 1)
+
+def _read_window(src, w, row0, row1, col0, col1):
+    """Janela em resolução plena: slice da banda (e da máscara de validade)
+    em RAM quando elas couberam lá. Retorna (arr, valid_ou_None)."""
+    band = getattr(app.state, "band", None)
+    if band is not None:
+        return band[row0:row1, col0:col1], app.state.valid[row0:row1, col0:col1]
+    return _thread_src(src).read(1, window=w, masked=False), None
+
+def _mask_out(h, w):
+    n = h * w
+    buf = getattr(_scratch, "buf", None)
+    if buf is None or buf.size < n:
+        buf = _scratch.buf = np.empty(n, dtype=np.uint8)
+    out = buf[:n].reshape(h, w)  # fatia 1-D -> contíguo, como o rasterize exige
+    out.fill(0)
+    return out
+
+def _bbox_window(src, bounds):
+    """Janela inteira do bbox, recortada ao raster. Retorna None quando não
+    sobra nenhum pixel.
+
+    Não usa Window.round_lengths: ele arredonda o comprimento sem compensar o
+    floor do offset (e no rasterio >= 1.4 ignora op=), o que pode comer a
+    última linha/coluna do bbox. Aqui o comprimento vem do ceil da borda."""
+    win = from_bounds(*bounds, transform=src.transform)
+    col0 = math.floor(win.col_off)
+    row0 = math.floor(win.row_off)
+    win = Window(col0, row0,
+                 math.ceil(win.col_off + win.width) - col0,
+                 math.ceil(win.row_off + win.height) - row0)
+    try:
+        w = win.intersection(Window(0, 0, src.width, src.height))
+    except WindowError:  # bbox totalmente fora do raster
+        return None
+    return w if w.width > 0 and w.height > 0 else None
+
+def _part_stats(src, geom_proj, exact):
+    """(soma, count, fator_overview) de uma parte já no CRS do raster."""
+    w = _bbox_window(src, geom_proj.bounds)
+    if w is None:
+        return 0.0, 0, 1
+    col0, row0 = int(w.col_off), int(w.row_off)
+    wh, ww = int(w.height), int(w.width)
+    col1, row1 = col0 + ww, row0 + wh
+    if wh * ww < 4:
+        # polígono menor que ~2x2 px: amostrar o centróide é mais barato (e mais
+        # estável) que rasterizar uma máscara que pode nem pegar um centro de pixel
+        cx, cy = geom_proj.centroid.coords[0]
+        v = _point_value(src, cx, cy)
+        return (v, 1, 1) if v is not None else (0.0, 0, 1)
+    w_transform = win_transform(w, src.transform)
+    bh, bw = src.block_shapes[0]
+    scale = 1
+    if wh <= bh and ww <= bw and w_transform.b == 0 and w_transform.d == 0:
+        # janela cabe num único tile: contains_xy nos centros de pixel dispensa
+        # todo o setup de scanline do rasterize (ganha no caso pequeno/alto QPS)
+        arr, valid_win = _read_window(src, w, row0, row1, col0, col1)
+        xs = w_transform.c + (np.arange(ww) + 0.5) * w_transform.a
+        ys = w_transform.f + (np.arange(wh) + 0.5) * w_transform.e
+        shapely.prepare(geom_proj)
+        mask_poly = shapely.contains_xy(geom_proj, *np.meshgrid(xs, ys))
+    else:
+        if not exact:
+            for f in sorted(src.overviews(1)):
+                if max(wh, ww) // f >= _ZONAL_TARGET_PX:
+                    scale = f
+        if scale > 1:
+            out_h, out_w = max(1, wh // scale), max(1, ww // scale)
+            arr = _thread_src(src).read(1, window=w, out_shape=(out_h, out_w),
+                                        resampling=Resampling.average, masked=False)
+            valid_win = None  # leitura reamostrada: filtra nodata por request
+            w_transform = w_transform * Affine.scale(ww / out_w, wh / out_h)
+            wh, ww = out_h, out_w
+        else:
+            arr, valid_win = _read_window(src, w, row0, row1, col0, col1)
+        if w_transform.b == 0 and w_transform.d == 0 and geom_proj.contains(
+                box(w_transform.c, w_transform.f + wh * w_transform.e,
+                    w_transform.c + ww * w_transform.a, w_transform.f)):
+            # polígono contém a janela inteira (ex.: polígono municipal sobre
+            # janela clampada): máscara seria toda 1, pula o rasterize
+            mask_poly = None
+        else:
+            mask_u8 = _mask_out(wh, ww)
+            # o rasterize aceita geometria shapely direto (__geo_interface__ sob
+            # demanda); sem o dict GeoJSON intermediário do mapping()
+            rasterize([(geom_proj, 1)], out=mask_u8, transform=w_transform)
+            mask_poly = mask_u8.view(bool)  # view, sem cópia (rasterize grava 0/1)
+    if mask_poly is None:
+        # só a validade dos pixels conta
+        if valid_win is not None:
+            mask_poly = valid_win  # uso somente-leitura do cache
+        else:
+            nodata = src.nodata
+            mask_poly = np.ones(arr.shape, dtype=bool) if nodata is None \
+                else np.not_equal(arr, nodata)
+            if arr.dtype.kind == "f":
+                np.logical_and(mask_poly, ~np.isnan(arr), out=mask_poly)
+    elif valid_win is not None:
+        # validade pré-computada no startup: um AND e acabou
+        np.logical_and(mask_poly, valid_win, out=mask_poly)
+    else:
         nodata = src.nodata
-        valid = mask_poly
         if nodata is not None:
-            valid &= (arr != nodata)
-        vals = arr[valid]
-        if vals.size == 0:
-            return {"mean": None, "count": 0, "note": "sem pixels válidos"}
-        return {"mean": float(np.nanmean(vals.astype(float))), "count": int(vals.size)}
+            # AND in-place no buffer da máscara: evita um bool temporário extra
+            np.logical_and(mask_poly, np.not_equal(arr, nodata), out=mask_poly)
+        if arr.dtype.kind == "f":
+            # banda float pode ter NaN além do nodata; sai da máscara também
+            np.logical_and(mask_poly, ~np.isnan(arr), out=mask_poly)
+    # reduz direto com sum(where=): sem o gather arr[mask] (alloc + passada extra)
+    n = int(np.count_nonzero(mask_poly))
+    if n == 0:
+        return 0.0, 0, scale
+    # banda inteira acumula em int64 (SIMD direto, sem upcast para float);
+    # float segue acumulando em float64
+    acc = np.int64 if arr.dtype.kind in "iu" else np.float64
+    return float(arr.sum(where=mask_poly, dtype=acc)), n, scale
+
+def _zonal_window(geom_wgs84, exact=False):
+    """Lê só a janela do bbox do polígono + rasteriza a máscara dentro dela.
+
+    Para polígonos grandes (janela >> 256 px) e raster com overviews (COG),
+    lê do overview mais grosso que ainda mantém ~256 px — leitura e rasterize
+    caem quadraticamente com o fator. `exact=True` força resolução plena.
+    Partes de MultiPolygon são computadas em paralelo (janelas independentes).
+    """
+    src = _get_src()
+    geom_proj = _to_src_crs(geom_wgs84, src)
+    # rejeição trivial por bbox (só floats) — sem construir box() nem rodar o
+    # predicado do GEOS no caso comum "clicou fora do raster"
+    gminx, gminy, gmaxx, gmaxy = geom_proj.bounds
+    rminx, rminy, rmaxx, rmaxy = src.bounds
+    if gmaxx < rminx or gminx > rmaxx or gmaxy < rminy or gminy > rmaxy:
+        return {"mean": None, "count": 0, "note": "fora do raster"}
+
+    if geom_proj.geom_type == "MultiPolygon" and len(geom_proj.geoms) > 1:
+        # partes de um MultiPolygon válido não se sobrepõem: somar (s, n) por
+        # parte dá o mesmo resultado da máscara única, e escala com os núcleos
+        parts = list(_zonal_pool.map(lambda g: _part_stats(src, g, exact),
+                                     geom_proj.geoms))
+    else:
+        parts = [_part_stats(src, geom_proj, exact)]
+
+    n = sum(p[1] for p in parts)
+    if n == 0:
+        return {"mean": None, "count": 0, "note": "sem pixels válidos"}
+    res = {"mean": sum(p[0] for p in parts) / n, "count": n}
+    scale = max(p[2] for p in parts)
+    if scale > 1:
+        res["note"] = f"aproximado via overview {scale}x"
+    return res
+
+# LRU de resultados por geometria: o mesmo polígono (favela clicada/salva)
+# repete o tempo todo no mapa; dois floats por entrada, custo de memória irrisório
+_zonal_cache: "OrderedDict[bytes, dict]" = OrderedDict()
+_ZONAL_CACHE_MAX = 1024
 
 @app.post("/zonal")
 def zonal_mean(q: PolygonQuery):
     try:
-        geom_wgs84 = _normalize_geom(q.geometry)
-        # escolhe estratégia
-        strategy = ZONAL_STRATEGY
-        if strategy == "window":
-            try:
-                return _zonal_window(geom_wgs84)
-            except Exception as e:
-                # fallback seguro para a antiga
-                fallback = _zonal_full(geom_wgs84)
-                fallback["note"] = f"fallback_full_por_erro_window: {e}"
-                return fallback
-        else:
-            return _zonal_full(geom_wgs84)
+        geom_wgs84 = _normalize_geom_cached(q.geometry)
+        key = hashlib.blake2b(geom_wgs84.wkb + (b"\x01" if q.exact else b"\x00"),
+                              digest_size=16).digest()
+        hit = _zonal_cache.get(key)
+        if hit is not None:
+            _zonal_cache.move_to_end(key)
+            return dict(hit)
+        res = _zonal_window(geom_wgs84, exact=q.exact)
+        _zonal_cache[key] = res
+        if len(_zonal_cache) > _ZONAL_CACHE_MAX:
+            _zonal_cache.popitem(last=False)
+        return res
     except HTTPException:
         raise
     except Exception as e:
@@ -254,30 +600,31 @@ def zonal_mean(q: PolygonQuery):
 @app.post("/echo_geometry")
 def echo_geometry(q: PolygonQuery):
     gi = q.geometry
-    kind = type(gi).__name__
-    sample = gi[:200] + "..." if isinstance(gi, str) and len(gi) > 200 else gi
-    return {"received_type": kind, "sample": sample}
+    n_rings = len(gi.coordinates) if gi.type == "Polygon" else sum(len(p) for p in gi.coordinates)
+    return {"received_type": gi.type, "n_rings": n_rings}
 
 @app.post("/zonal_debug")
 def zonal_debug(q: PolygonQuery):
     try:
-        geom_wgs84 = _normalize_geom(q.geometry)
-        with rasterio.open(caminho_geotiff) as src:
-            geom_proj = _to_src_crs(geom_wgs84, src)
-            bbox = box(*src.bounds)
-            minx, miny, maxx, maxy = geom_proj.bounds
-            win = from_bounds(minx, miny, maxx, maxy, transform=src.transform)
-            col0 = max(0, int(np.floor(win.col_off)))
-            row0 = max(0, int(np.floor(win.row_off)))
-            col1 = min(src.width,  int(np.ceil(win.col_off + win.width)))
-            row1 = min(src.height, int(np.ceil(win.row_off + win.height)))
-            return {
-                "validity": explain_validity(geom_wgs84),
-                "intersects_raster": bool(geom_proj.intersects(bbox)),
-                "raster_crs": str(src.crs),
-                "raster_bounds": list(src.bounds),
-                "window": {"col0": col0, "row0": row0, "col1": col1, "row1": row1},
-                "strategy": ZONAL_STRATEGY
-            }
+        geom_wgs84 = _normalize_geom_cached(q.geometry)
+        src = _get_src()
+        geom_proj = _to_src_crs(geom_wgs84, src)
+        w = _bbox_window(src, geom_proj.bounds)
+        if w is None:
+            window = None
+        else:
+            window = {"col0": int(w.col_off), "row0": int(w.row_off),
+                      "col1": int(w.col_off + w.width), "row1": int(w.row_off + w.height)}
+        return {
+            "validity": is_valid_reason(geom_wgs84),
+            # mesmo teste de bbox que o /zonal usa para rejeitar (sem montar
+            # um shapely box nem rodar intersects do GEOS só para diagnóstico)
+            "intersects_raster": w is not None,
+            "raster_crs": str(src.crs),
+            "raster_bounds": list(src.bounds),
+            "window": window
+        }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))